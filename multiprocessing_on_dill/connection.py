@@ -9,10 +9,14 @@
 
 __all__ = [ 'Client', 'Listener', 'Pipe', 'wait' ]
 
+import contextlib
+import hashlib
+import hmac
 import io
 import os
 import sys
 import socket
+import stat
 import struct
 import time
 import tempfile
@@ -25,6 +29,7 @@ from . import util
 from . import AuthenticationError, BufferTooShort
 from .context import reduction
 _ForkingPickler = reduction.ForkingPickler
+_HAVE_PICKLE_BUFFER = reduction.HAVE_PICKLE_BUFFER
 
 _winapi = None
 
@@ -38,6 +43,33 @@ CONNECTION_TIMEOUT = 20.
 
 _mmap_counter = itertools.count()
 
+# On connections with extended frames enabled, pickle buffers at least this
+# large are sent out-of-band, next to the pickle data rather than copied
+# into it
+OUT_OF_BAND_THRESHOLD = 16384
+# Message header: the length of the message
+_HEADER = struct.Struct("!i")
+_HEADER_SIZE = _HEADER.size
+# Extended frames are always understood by recv(), but only sent by send()
+# on connections created with extended_frames=True, as older versions and
+# recv_bytes() cannot read them.
+# Header value announcing a message with out-of-band buffers, followed by
+# the length of the pickle data and the number of buffers
+_OUT_OF_BAND = -2
+_OOB_HEADER = struct.Struct("!iI")
+# Header values announcing a bytes or bytearray object sent by send()
+# without pickling, followed by its length
+_RAW_BYTES = -3
+_RAW_BYTEARRAY = -4
+_RAW_HEADER = struct.Struct("!ii")
+_RAW_KINDS = {bytes: _RAW_BYTES, bytearray: _RAW_BYTEARRAY}
+# Maximum number of buffers passed to a single writev() call
+_IOV_MAX = 1024
+# Batched messages are written out once this many bytes are pending
+BATCH_SIZE = 65536
+# Send and receive buffer sizes of AF_INET sockets (None for the default)
+SOCKET_BUFSIZE = 1 << 20
+
 default_family = 'AF_INET'
 families = ['AF_INET']
 
@@ -102,8 +134,10 @@ def address_type(address):
 
 class _ConnectionBase:
     _handle = None
+    _wbuf = None
 
-    def __init__(self, handle, readable=True, writable=True):
+    def __init__(self, handle, readable=True, writable=True,
+                 extended_frames=False):
         handle = handle.__index__()
         if handle < 0:
             raise ValueError("invalid handle")
@@ -113,6 +147,7 @@ class _ConnectionBase:
         self._handle = handle
         self._readable = readable
         self._writable = writable
+        self._extended_frames = extended_frames
 
     # XXX should we use util.Finalize instead of a __del__?
 
@@ -154,6 +189,11 @@ class _ConnectionBase:
         """True if the connection is writable"""
         return self._writable
 
+    @property
+    def extended_frames(self):
+        """True if send() may use message frames only recv() understands"""
+        return self._extended_frames
+
     def fileno(self):
         """File descriptor or handle of the connection"""
         self._check_closed()
@@ -163,18 +203,70 @@ class _ConnectionBase:
         """Close the connection"""
         if self._handle is not None:
             try:
-                self._close()
+                self._flush_batch()
             finally:
-                self._handle = None
+                self._wbuf = None
+                try:
+                    self._close()
+                finally:
+                    self._handle = None
+
+    def begin_batch(self):
+        """
+        Start buffering sent messages, to write them out together.
+
+        Messages are still received in the order they were sent.  Pending
+        messages are written out by end_batch(), once BATCH_SIZE bytes are
+        pending, and before receiving, polling, waiting on or closing the
+        connection.
+        """
+        self._check_closed()
+        self._check_writable()
+        if self._wbuf is None:
+            self._wbuf = bytearray()
+
+    def end_batch(self):
+        """Write out any pending messages and stop buffering"""
+        self._check_closed()
+        try:
+            self._flush_batch()
+        finally:
+            self._wbuf = None
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Context manager calling begin_batch() and end_batch()"""
+        self.begin_batch()
+        try:
+            yield self
+        finally:
+            self.end_batch()
+
+    def _take_batch(self):
+        # Return the pending messages as a list of buffers to be written
+        wbuf = self._wbuf
+        if not wbuf:
+            return []
+        self._wbuf = bytearray()
+        return [wbuf]
+
+    def _flush_batch(self):
+        if self._wbuf:
+            self._sendv(self._take_batch())
 
     def send_bytes(self, buf, offset=0, size=None):
         """Send the bytes data from a bytes-like object"""
         self._check_closed()
         self._check_writable()
+        if offset == 0 and size is None and type(buf) in (bytes, bytearray):
+            # Common case: nothing to validate or slice
+            self._send_bytes(buf)
+            return
         m = memoryview(buf)
-        # HACK for byte-indexing of non-bytewise buffers (e.g. array.array)
+        # HACK for byte-indexing of non-bytewise buffers (e.g. array.array);
+        # only non-contiguous buffers need to be copied
         if m.itemsize > 1:
-            m = memoryview(bytes(m))
+            m = m.cast('B') if m.c_contiguous else memoryview(bytes(m))
         n = len(m)
         if offset < 0:
             raise ValueError("offset is negative")
@@ -192,7 +284,22 @@ class _ConnectionBase:
         """Send a (picklable) object"""
         self._check_closed()
         self._check_writable()
-        self._send_bytes(_ForkingPickler.dumps(obj))
+        if not self._extended_frames:
+            self._send_bytes(_ForkingPickler.dumps(obj))
+            return
+        kind = _RAW_KINDS.get(type(obj))
+        if kind is not None:
+            # Already serialized: skip the pickler and its copy of the data
+            self._send_bytes(obj, kind)
+            return
+        if not _HAVE_PICKLE_BUFFER:
+            self._send_bytes(_ForkingPickler.dumps(obj))
+            return
+        buf, buffers = _ForkingPickler.dumps_buffers(obj, OUT_OF_BAND_THRESHOLD)
+        if buffers:
+            self._send_bytes_oob(buf, buffers)
+        else:
+            self._send_bytes(buf)
 
     def recv_bytes(self, maxlength=None):
         """
@@ -200,12 +307,13 @@ class _ConnectionBase:
         """
         self._check_closed()
         self._check_readable()
+        self._flush_batch()
         if maxlength is not None and maxlength < 0:
             raise ValueError("negative maxlength")
         buf = self._recv_bytes(maxlength)
         if buf is None:
             self._bad_message_length()
-        return buf.getvalue()
+        return bytes(buf)
 
     def recv_bytes_into(self, buf, offset=0):
         """
@@ -214,6 +322,7 @@ class _ConnectionBase:
         """
         self._check_closed()
         self._check_readable()
+        self._flush_batch()
         with memoryview(buf) as m:
             # Get bytesize of arbitrary buffer
             itemsize = m.itemsize
@@ -222,27 +331,59 @@ class _ConnectionBase:
                 raise ValueError("negative offset")
             elif offset > bytesize:
                 raise ValueError("offset too large")
-            result = self._recv_bytes()
-            size = result.tell()
-            if bytesize < offset + size:
-                raise BufferTooShort(result.getvalue())
-            # Message can fit in dest
-            result.seek(0)
-            result.readinto(m[offset // itemsize :
-                              (offset + size) // itemsize])
+            with m.cast('B') as dest:
+                size = self._recv_bytes_into(dest, offset)
+            if size is None:
+                self._bad_message_length()
             return size
 
     def recv(self):
         """Receive a (picklable) object"""
         self._check_closed()
         self._check_readable()
-        buf = self._recv_bytes()
-        return _ForkingPickler.loads(buf.getbuffer())
+        self._flush_batch()
+        kind, buf, buffers = self._recv_message()
+        if kind == _RAW_BYTES:
+            return bytes(buf)
+        elif kind == _RAW_BYTEARRAY:
+            return buf
+        return _ForkingPickler.loads(buf, buffers=buffers)
+
+    def recv_bytes_batch(self, maxsize=BATCH_SIZE):
+        """
+        Receive the messages which are already available, up to `maxsize`
+        bytes in total, as a list of bytes objects.
+
+        Blocks until at least one message is available, like recv_bytes().
+        """
+        self._check_closed()
+        self._check_readable()
+        self._flush_batch()
+        frames = self._recv_frames(maxsize)
+        if frames is None:
+            return [self.recv_bytes()]
+        return [bytes(m) for m in frames]
+
+    def recv_batch(self, maxsize=BATCH_SIZE):
+        """
+        Receive the objects which are already available, up to `maxsize`
+        bytes of messages in total, as a list.
+
+        Blocks until at least one object is available, like recv().
+        """
+        self._check_closed()
+        self._check_readable()
+        self._flush_batch()
+        frames = self._recv_frames(maxsize)
+        if frames is None:
+            return [self.recv()]
+        return [_ForkingPickler.loads(m) for m in frames]
 
     def poll(self, timeout=0.0):
         """Whether there is any input available to be read"""
         self._check_closed()
         self._check_readable()
+        self._flush_batch()
         return self._poll(timeout)
 
     def __enter__(self):
@@ -258,63 +399,197 @@ class Connection(_ConnectionBase):
     a socket handle (Windows).
     """
 
+    _peek_sock = None
+
     def _close(self, _close=os.close):
+        if self._peek_sock:
+            self._peek_sock.detach()
         _close(self._handle)
-    _write = os.write
+    _writev = os.writev
     _read = os.read
+    _readv = os.readv
 
-    def _send(self, buf, write=_write):
-        remaining = len(buf)
-        while True:
-            n = write(self._handle, buf)
-            remaining -= n
-            if remaining == 0:
-                break
-            buf = buf[n:]
-
-    def _recv(self, size, read=_read):
-        buf = io.BytesIO()
+    def _sendv(self, bufs, writev=_writev):
+        bufs = [m.cast('B') for m in map(memoryview, bufs) if m.nbytes]
         handle = self._handle
-        remaining = size
-        while remaining > 0:
-            chunk = read(handle, remaining)
-            n = len(chunk)
+        i = 0
+        while i < len(bufs):
+            n = writev(handle, bufs[i:i + _IOV_MAX])
+            while i < len(bufs) and n >= bufs[i].nbytes:
+                n -= bufs[i].nbytes
+                i += 1
+            if n:
+                bufs[i] = bufs[i][n:]
+
+    def _recv(self, size):
+        buf = bytearray(size)
+        with memoryview(buf) as m:
+            self._recv_into(m)
+        return buf
+
+    def _recv_into(self, m, readv=_readv):
+        # Fill the byte-wise memoryview `m` from the connection
+        handle = self._handle
+        size = len(m)
+        offset = 0
+        while offset < size:
+            n = readv(handle, [m[offset:]])
             if n == 0:
-                if remaining == size:
+                if offset == 0:
                     raise EOFError
                 else:
                     raise OSError("got end of file during message")
-            buf.write(chunk)
-            remaining -= n
-        return buf
+            offset += n
 
-    def _send_bytes(self, buf):
+    def _send_bytes(self, buf, kind=None):
         n = len(buf)
-        # For wire compatibility with 3.2 and lower
-        header = struct.pack("!i", n)
-        if n > 16384:
-            # The payload is large so Nagle's algorithm won't be triggered
-            # and we'd better avoid the cost of concatenation.
-            self._send(header)
-            self._send(buf)
+        if kind is None:
+            # For wire compatibility with 3.2 and lower
+            header = _HEADER.pack(n)
         else:
-            # Issue #20540: concatenate before sending, to avoid delays due
-            # to Nagle's algorithm on a TCP socket.
-            # Also note we want to avoid sending a 0-length buffer separately,
-            # to avoid "broken pipe" errors if the other end closed the pipe.
-            self._send(header + buf)
+            header = _RAW_HEADER.pack(kind, n)
+        wbuf = self._wbuf
+        if wbuf is not None and len(wbuf) + len(header) + n < BATCH_SIZE:
+            wbuf += header
+            wbuf += buf
+            return
+        # Gather header and payload into a single write: this avoids both
+        # the cost of concatenation and delays due to Nagle's algorithm on
+        # a TCP socket (issue #20540), and never sends a 0-length buffer
+        # on its own, to avoid "broken pipe" errors if the other end
+        # closed the pipe.
+        self._sendv(self._take_batch() + [header, buf])
+
+    def _send_bytes_oob(self, buf, buffers):
+        lengths = [m.nbytes for m in buffers]
+        header = (_HEADER.pack(_OUT_OF_BAND) +
+                  _OOB_HEADER.pack(len(buf), len(buffers)) +
+                  struct.pack("!%dQ" % len(buffers), *lengths))
+        self._sendv(self._take_batch() + [header, buf] + buffers)
 
     def _recv_bytes(self, maxsize=None):
-        buf = self._recv(4)
-        size, = struct.unpack("!i", buf.getvalue())
-        if maxsize is not None and size > maxsize:
+        buf = self._recv(_HEADER_SIZE)
+        size, = _HEADER.unpack_from(buf, 0)
+        # Negative sizes announce messages which only recv() understands
+        if size < 0 or (maxsize is not None and size > maxsize):
             return None
         return self._recv(size)
 
+    def _recv_frames(self, maxsize):
+        # Receive all the plain messages which are complete in the first
+        # `maxsize` bytes available, with a single read, as a list of
+        # memoryviews.  Peeking at the data first means nothing is ever
+        # buffered here, out of sight of poll() and wait().  Returns None if
+        # there is no such message, or if the handle is not a socket.
+        sock = self._peek_socket()
+        if sock is None:
+            return None
+        frames = _parse_frames(sock.recv(maxsize, socket.MSG_PEEK))
+        if not frames:
+            return None
+        offset, size = frames[-1]
+        m = memoryview(self._recv(offset + size))
+        return [m[offset:offset + size] for offset, size in frames]
+
+    def _peek_socket(self):
+        # Return a socket object sharing our handle, or None for pipes
+        sock = self._peek_sock
+        if sock is None:
+            if stat.S_ISSOCK(os.fstat(self._handle).st_mode):
+                sock = socket.socket(fileno=self._handle)
+                sock.setblocking(True)
+            else:
+                sock = False
+            self._peek_sock = sock
+        return sock or None
+
+    def _recv_bytes_into(self, m, offset):
+        # Receive a message straight into the byte-wise memoryview `m` at
+        # `offset`, returning its size
+        buf = self._recv(_HEADER_SIZE)
+        size, = _HEADER.unpack_from(buf, 0)
+        if size < 0:
+            return None
+        if len(m) < offset + size:
+            raise BufferTooShort(bytes(self._recv(size)))
+        self._recv_into(m[offset:offset + size])
+        return size
+
+    def _recv_message(self):
+        # Receive a message sent by send(), returning its kind (None for
+        # pickle data), its data and its out-of-band buffers
+        buf = self._recv(_HEADER_SIZE)
+        size, = _HEADER.unpack_from(buf, 0)
+        if size >= 0:
+            return None, self._recv(size), ()
+        elif size == _OUT_OF_BAND:
+            size, nbuffers = _OOB_HEADER.unpack(self._recv(_OOB_HEADER.size))
+            lengths = struct.unpack("!%dQ" % nbuffers, self._recv(8 * nbuffers))
+            buf = self._recv(size)
+            return _OUT_OF_BAND, buf, [self._recv(n) for n in lengths]
+        elif size in (_RAW_BYTES, _RAW_BYTEARRAY):
+            n, = _HEADER.unpack_from(self._recv(_HEADER_SIZE), 0)
+            return size, self._recv(n), ()
+        else:
+            self._bad_message_length()
+
     def _poll(self, timeout):
+        if timeout == 0:
+            return _poll_now(self._handle)
         r = wait([self], timeout)
         return bool(r)
 
+    def send_file(self, fileobj, size):
+        """
+        Send `size` bytes read from the file object `fileobj`, to be received
+        as a single message by recv_bytes() or recv_bytes_into().
+
+        Where possible the data is copied by the kernel with sendfile(),
+        without going through user space.
+        """
+        self._check_closed()
+        self._check_writable()
+        if size < 0:
+            raise ValueError("size is negative")
+        # sendfile() needs an fd and an explicit offset: a non-seekable file
+        # (e.g. a pipe) may be refused, and would skip any buffered data
+        try:
+            infd = fileobj.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            infd = None
+        if infd is None or not (self._can_sendfile() and fileobj.seekable()):
+            self._send_bytes(_read_exactly(fileobj, size))
+            return
+        # Use the logical position of (possibly buffered) file objects
+        offset = fileobj.tell()
+        # Fail before the header is sent when we know the file is too short
+        if os.fstat(infd).st_size - offset < size:
+            raise OSError("got end of file before %d bytes" % size)
+        self._sendv(self._take_batch() + [_HEADER.pack(size)])
+        sent = 0
+        while sent < size:
+            try:
+                n = os.sendfile(self._handle, infd, offset + sent, size - sent)
+            except OSError:
+                # e.g. a file system without sendfile() support: the header
+                # is out already, so send the rest the slow way
+                data = os.pread(infd, size - sent, offset + sent)
+                if data:
+                    self._sendv([data])
+                n = len(data)
+            if n == 0:
+                raise OSError("got end of file before %d bytes" % size)
+            sent += n
+        fileobj.seek(offset + size)
+
+    def _can_sendfile(self):
+        # Linux can sendfile() to any file, other systems only to sockets
+        if not hasattr(os, 'sendfile'):
+            return False
+        if sys.platform.startswith('linux'):
+            return True
+        return stat.S_ISSOCK(os.fstat(self._handle).st_mode)
+
 
 #
 # Public functions
@@ -327,21 +602,32 @@ class Listener(object):
     This is a wrapper for a bound socket which is 'listening' for
     connections, or for a Windows named pipe.
     '''
-    def __init__(self, address=None, family=None, backlog=1, authkey=None):
+    def __init__(self, address=None, family=None, backlog=1, authkey=None,
+                 reuseport=False, extended_frames=False):
         family = family or (address and address_type(address)) \
                  or default_family
         address = address or arbitrary_address(family)
 
         _validate_family(family)
+        if reuseport:
+            if family != 'AF_INET':
+                raise ValueError('reuseport requires the AF_INET family')
+            if not hasattr(socket, 'SO_REUSEPORT'):
+                raise ValueError('SO_REUSEPORT is not available')
         if family == 'AF_PIPE':
             self._listener = PipeListener(address, backlog)
         else:
-            self._listener = SocketListener(address, family, backlog)
+            self._listener = SocketListener(address, family, backlog,
+                                            reuseport)
 
         if authkey is not None and not isinstance(authkey, bytes):
             raise TypeError('authkey should be a byte string')
 
         self._authkey = authkey
+        self._family = family
+        self._backlog = backlog
+        self._reuseport = reuseport
+        self._extended_frames = extended_frames
 
     def accept(self):
         '''
@@ -352,11 +638,29 @@ class Listener(object):
         if self._listener is None:
             raise OSError('listener is closed')
         c = self._listener.accept()
+        c._extended_frames = self._extended_frames
         if self._authkey:
             deliver_challenge(c, self._authkey)
             answer_challenge(c, self._authkey)
         return c
 
+    def clones(self, n):
+        '''
+        Return a list of `n` new listeners bound to the same address as `self`.
+
+        `self` must have been created with `reuseport=True`.  The kernel then
+        distributes incoming connections between all the listeners, each of
+        which can be accepting in a different process.
+        '''
+        if self._listener is None:
+            raise OSError('listener is closed')
+        if not self._reuseport:
+            raise ValueError('listener was not created with reuseport=True')
+        return [Listener(self.address, self._family, self._backlog,
+                         self._authkey, reuseport=True,
+                         extended_frames=self._extended_frames)
+                for i in range(n)]
+
     def close(self):
         '''
         Close the bound socket or named pipe of `self`.
@@ -381,7 +685,7 @@ class Listener(object):
         self.close()
 
 
-def Client(address, family=None, authkey=None):
+def Client(address, family=None, authkey=None, extended_frames=False):
     '''
     Returns a connection to the address of a `Listener`
     '''
@@ -391,6 +695,7 @@ def Client(address, family=None, authkey=None):
         c = PipeClient(address)
     else:
         c = SocketClient(address)
+    c._extended_frames = extended_frames
 
     if authkey is not None and not isinstance(authkey, bytes):
         raise TypeError('authkey should be a byte string')
@@ -402,20 +707,24 @@ def Client(address, family=None, authkey=None):
     return c
 
 
-def Pipe(duplex=True):
+def Pipe(duplex=True, extended_frames=False):
     '''
     Returns pair of connection objects at either end of a pipe
+
+    With `extended_frames`, send() sends bytes and bytearray objects without
+    pickling them, and large buffers out-of-band.  Such messages can only
+    be received by recv() of this version.
     '''
     if duplex:
         s1, s2 = socket.socketpair()
         s1.setblocking(True)
         s2.setblocking(True)
-        c1 = Connection(s1.detach())
-        c2 = Connection(s2.detach())
+        c1 = Connection(s1.detach(), extended_frames=extended_frames)
+        c2 = Connection(s2.detach(), extended_frames=extended_frames)
     else:
         fd1, fd2 = os.pipe()
-        c1 = Connection(fd1, writable=False)
-        c2 = Connection(fd2, readable=False)
+        c1 = Connection(fd1, writable=False, extended_frames=extended_frames)
+        c2 = Connection(fd2, readable=False, extended_frames=extended_frames)
 
     return c1, c2
 
@@ -427,13 +736,20 @@ class SocketListener(object):
     '''
     Representation of a socket which is bound to an address and listening
     '''
-    def __init__(self, address, family, backlog=1):
+    def __init__(self, address, family, backlog=1, reuseport=False):
         self._socket = socket.socket(getattr(socket, family))
         try:
             # SO_REUSEADDR has different semantics on Windows (issue #2550).
             if os.name == 'posix':
                 self._socket.setsockopt(socket.SOL_SOCKET,
                                         socket.SO_REUSEADDR, 1)
+            # Let several listening sockets share the address, with the
+            # kernel balancing incoming connections between them
+            if reuseport:
+                self._socket.setsockopt(socket.SOL_SOCKET,
+                                        socket.SO_REUSEPORT, 1)
+            if family == 'AF_INET':
+                _configure_inet_socket(self._socket)
             self._socket.setblocking(True)
             self._socket.bind(address)
             self._socket.listen(backlog)
@@ -453,6 +769,8 @@ class SocketListener(object):
 
     def accept(self):
         s, self._last_accepted = self._socket.accept()
+        if self._family == 'AF_INET':
+            _configure_inet_socket(s)
         s.setblocking(True)
         return Connection(s.detach())
 
@@ -466,12 +784,53 @@ class SocketListener(object):
                 unlink()
 
 
+def _read_exactly(fileobj, size):
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        data = fileobj.read(remaining)
+        if not data:
+            raise OSError("got end of file before %d bytes" % size)
+        chunks.append(data)
+        remaining -= len(data)
+    return b''.join(chunks)
+
+def _parse_frames(buf):
+    '''
+    Return the (offset, size) of the payload of each complete plain message
+    at the start of `buf`
+    '''
+    frames = []
+    unpack_from = _HEADER.unpack_from
+    end = len(buf)
+    offset = 0
+    while offset + _HEADER_SIZE <= end:
+        size, = unpack_from(buf, offset)
+        offset += _HEADER_SIZE
+        if size < 0 or offset + size > end:
+            break
+        frames.append((offset, size))
+        offset += size
+    return frames
+
+def _configure_inet_socket(s):
+    '''
+    Disable Nagle's algorithm, which only delays our messages since
+    each one is written in one go, and enlarge the socket buffers
+    '''
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if SOCKET_BUFSIZE is not None:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFSIZE)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFSIZE)
+
 def SocketClient(address):
     '''
     Return a connection object connected to the socket given by `address`
     '''
     family = address_type(address)
     with socket.socket( getattr(socket, family) ) as s:
+        if family == 'AF_INET':
+            _configure_inet_socket(s)
         s.setblocking(True)
         s.connect(address)
         return Connection(s.detach())
@@ -489,31 +848,52 @@ MESSAGE_LENGTH = 20
 CHALLENGE = b'#CHALLENGE#'
 WELCOME = b'#WELCOME#'
 FAILURE = b'#FAILURE#'
+_CHALLENGE_LEN = len(CHALLENGE)
+
+# Challenges start with this tag to ask for a keyed BLAKE2b digest, which
+# is sent back with the same tag.  Older peers ignore it and answer with
+# the HMAC-MD5 digest of the whole message, which is still accepted.
+_BLAKE2B_TAG = b'{blake2b}'
+_BLAKE2B_TAG_LEN = len(_BLAKE2B_TAG)
+
+_blake2b = hashlib.blake2b
+
+def _blake2b_digest(authkey, message):
+    if len(authkey) > _blake2b.MAX_KEY_SIZE:
+        authkey = _blake2b(authkey).digest()
+    return _blake2b(message, key=authkey, digest_size=16).digest()
+
+def _md5_digest(authkey, message):
+    return hmac.new(authkey, message, 'md5').digest()
 
 def deliver_challenge(connection, authkey):
-    import hmac
     if not isinstance(authkey, bytes):
         raise ValueError(
             "Authkey must be bytes, not {0!s}".format(type(authkey)))
-    message = os.urandom(MESSAGE_LENGTH)
+    message = _BLAKE2B_TAG + os.urandom(MESSAGE_LENGTH)
     connection.send_bytes(CHALLENGE + message)
-    digest = hmac.new(authkey, message, 'md5').digest()
     response = connection.recv_bytes(256)        # reject large message
-    if response == digest:
+    if response[:_BLAKE2B_TAG_LEN] == _BLAKE2B_TAG:
+        digest = _BLAKE2B_TAG + _blake2b_digest(authkey, message)
+    else:
+        digest = _md5_digest(authkey, message)   # legacy peer
+    if hmac.compare_digest(response, digest):
         connection.send_bytes(WELCOME)
     else:
         connection.send_bytes(FAILURE)
         raise AuthenticationError('digest received was wrong')
 
 def answer_challenge(connection, authkey):
-    import hmac
     if not isinstance(authkey, bytes):
         raise ValueError(
             "Authkey must be bytes, not {0!s}".format(type(authkey)))
     message = connection.recv_bytes(256)         # reject large message
-    assert message[:len(CHALLENGE)] == CHALLENGE, 'message = %r' % message
-    message = message[len(CHALLENGE):]
-    digest = hmac.new(authkey, message, 'md5').digest()
+    assert message[:_CHALLENGE_LEN] == CHALLENGE, 'message = %r' % message
+    message = message[_CHALLENGE_LEN:]
+    if message[:_BLAKE2B_TAG_LEN] == _BLAKE2B_TAG:
+        digest = _BLAKE2B_TAG + _blake2b_digest(authkey, message)
+    else:
+        digest = _md5_digest(authkey, message)   # legacy peer
     connection.send_bytes(digest)
     response = connection.recv_bytes(256)        # reject large message
     if response != WELCOME:
@@ -561,38 +941,75 @@ def XmlClient(*args, **kwds):
 # Wait
 #
 
+import select
 import selectors
 
 # poll/select have the advantage of not requiring any extra file
 # descriptor, contrarily to epoll/kqueue (also, they require a single
-# syscall).
+# syscall).  They also keep no kernel side state, so the selector can be
+# kept per thread and reused across calls: only the fds which changed
+# since the previous call need to be (un)registered, and a closed and
+# reused fd is simply polled again.
 if hasattr(selectors, 'PollSelector'):
     _WaitSelector = selectors.PollSelector
 else:
     _WaitSelector = selectors.SelectSelector
 
+class _WaitState(util.ForkAwareLocal):
+    selector = None
+
+_wait_state = _WaitState()
+
+# Checking whether a single fd is readable right now (as poll() does by
+# default) is cheapest without the selector machinery of wait()
+if hasattr(select, 'poll'):
+    def _poll_now(fd):
+        p = select.poll()
+        p.register(fd, select.POLLIN)
+        return bool(p.poll(0))
+else:
+    def _poll_now(fd):
+        return bool(select.select([fd], [], [], 0)[0])
+
 def wait(object_list, timeout=None):
     '''
     Wait till an object in object_list is ready/readable.
 
     Returns list of those objects in object_list which are ready/readable.
     '''
-    with _WaitSelector() as selector:
-        for obj in object_list:
-            selector.register(obj, selectors.EVENT_READ)
-
-        if timeout is not None:
-            deadline = time.time() + timeout
-
-        while True:
-            ready = selector.select(timeout)
-            if ready:
-                return [key.fileobj for (key, events) in ready]
-            else:
-                if timeout is not None:
-                    timeout = deadline - time.time()
-                    if timeout < 0:
-                        return ready
+    objects = {}
+    for obj in object_list:
+        if isinstance(obj, int):
+            fd = obj
+        else:
+            if getattr(obj, '_wbuf', None):
+                # The reply we wait for may depend on a pending message
+                obj._flush_batch()
+            fd = int(obj.fileno())
+        objects[fd] = obj
+
+    selector = _wait_state.selector
+    if selector is None:
+        selector = _wait_state.selector = _WaitSelector()
+    registered = selector.get_map()
+    for fd in [fd for fd in registered if fd not in objects]:
+        selector.unregister(fd)
+    for fd in objects:
+        if fd not in registered:
+            selector.register(fd, selectors.EVENT_READ)
+
+    if timeout is not None:
+        deadline = time.time() + timeout
+
+    while True:
+        ready = selector.select(timeout)
+        if ready:
+            return [objects[key.fd] for (key, events) in ready]
+        else:
+            if timeout is not None:
+                timeout = deadline - time.time()
+                if timeout < 0:
+                    return ready
 
 #
 # Make connection and socket objects sharable if possible
@@ -600,8 +1017,9 @@ def wait(object_list, timeout=None):
 
 def reduce_connection(conn):
     df = reduction.DupFd(conn.fileno())
-    return rebuild_connection, (df, conn.readable, conn.writable)
-def rebuild_connection(df, readable, writable):
+    return rebuild_connection, (df, conn.readable, conn.writable,
+                                conn.extended_frames)
+def rebuild_connection(df, readable, writable, extended_frames=False):
     fd = df.detach()
-    return Connection(fd, readable, writable)
+    return Connection(fd, readable, writable, extended_frames)
 reduction.register(Connection, reduce_connection)
@@ -56,10 +56,10 @@ class BaseContext(object):
         m.start()
         return m
 
-    def Pipe(self, duplex=True):
+    def Pipe(self, duplex=True, extended_frames=False):
         '''Returns two connection object connected by a pipe'''
         from .connection import Pipe
-        return Pipe(duplex)
+        return Pipe(duplex, extended_frames)
 
     def Lock(self):
         '''Returns a non-recursive lock object'''
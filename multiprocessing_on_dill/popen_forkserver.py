@@ -2,6 +2,7 @@ import io
 import os
 
 from .context import reduction, set_spawning_popen
+from .reduction import _add_undo
 if not reduction.HAVE_SEND_HANDLE:
     raise ImportError('No support for sending fds between processes')
 from . import forkserver
@@ -36,6 +37,8 @@ class Popen(popen_fork.Popen):
 
     def duplicate_for_child(self, fd):
         self._fds.append(fd)
+        # Forget the fd again if the pickling attempt is retried with dill
+        _add_undo(self._fds.pop)
         return len(self._fds) - 1
 
     def _launch(self, process_obj):
@@ -2,6 +2,7 @@ import io
 import os
 
 from .context import reduction, set_spawning_popen
+from .reduction import _add_undo
 from . import popen_fork
 from . import spawn
 from . import util
@@ -33,6 +34,8 @@ class Popen(popen_fork.Popen):
 
     def duplicate_for_child(self, fd):
         self._fds.append(fd)
+        # Forget the fd again if the pickling attempt is retried with dill
+        _add_undo(self._fds.pop)
         return fd
 
     def _launch(self, process_obj):
@@ -12,9 +12,12 @@ import copyreg
 import functools
 import io
 import os
-import dill as pickle
+import pickle
+import dill
 import socket
 import sys
+import threading
+import types
 
 from . import context
 
@@ -25,38 +28,161 @@ HAVE_SEND_HANDLE = (hasattr(socket, 'CMSG_LEN') and
                     hasattr(socket, 'SCM_RIGHTS') and
                     hasattr(socket.socket, 'sendmsg'))
 
+# Protocol 5 (PEP 574) allows buffers to be transferred out-of-band
+HAVE_PICKLE_BUFFER = pickle.HIGHEST_PROTOCOL >= 5
+
+# Always pickle with dill, rather than only when the standard pickler fails
+FORCE_DILL = False
+
+# Errors from the standard pickler which mean dill should be tried instead
+_DILL_FALLBACK_ERRORS = (pickle.PicklingError, TypeError, AttributeError)
+
 #
 # Pickler subclass
 #
 
+# Dispatch tables shared by all picklers, see _make_dispatch_table()
+_dispatch_tables = {}
+
+# Reducers which register resources (see DupFd()) add a function undoing
+# the registration to `_undo_state.log`, so that nothing is leaked when
+# the standard pickler gives up and dill pickles the object again
+_undo_state = threading.local()
+
+def _add_undo(func):
+    log = getattr(_undo_state, 'log', None)
+    if log is not None:
+        log.append(func)
+
 class ForkingPickler(pickle.Pickler):
-    '''Pickler subclass used by multiprocessing_on_dill.'''
+    '''Pickler subclass used by multiprocessing_on_dill.
+
+    Objects are pickled with the (much faster) standard pickler, falling
+    back to dill for those it cannot handle, such as lambdas and closures,
+    and for functions and classes of __main__, which dill pickles by value.
+    '''
     _extra_reducers = {}
+    # Reducers for types whose data can be sent out-of-band as a
+    # PickleBuffer, only used by picklers given a buffer_callback (see
+    # dumps_buffers()): in-band they would save nothing, and older versions
+    # could not load the result
+    _buffer_reducers = {}
     _copyreg_dispatch_table = copyreg.dispatch_table
 
-    def __init__(self, *args):
-        super().__init__(*args)
-        self.dispatch_table = self._copyreg_dispatch_table.copy()
-        self.dispatch_table.update(self._extra_reducers)
+    def __init__(self, file, protocol=None, *args, **kwds):
+        super().__init__(file, protocol, *args, **kwds)
+        self.dispatch_table = self._make_dispatch_table(
+            kwds.get('buffer_callback') is not None)
+
+    def reducer_override(self, obj):
+        # Other processes may lack the names of __main__ (e.g. functions
+        # defined in a notebook after a pool has forked, or in a spawned
+        # child of an interactive session), so let dill pickle them by value
+        if (isinstance(obj, (types.FunctionType, type)) and
+                getattr(obj, '__module__', None) == '__main__'):
+            raise pickle.PicklingError(
+                '%r is pickled by value with dill' % (obj,))
+        return NotImplemented
+
+    @classmethod
+    def _make_dispatch_table(cls, out_of_band):
+        # Dispatch tables are only read by picklers, so they are built once
+        # and shared until a reducer is registered, or copyreg's table
+        # differs from the copy it was built from
+        key = (cls, out_of_band)
+        copyreg_table = cls._copyreg_dispatch_table
+        cached = _dispatch_tables.get(key)
+        if cached is not None and cached[0] == copyreg_table:
+            return cached[1]
+        snapshot = copyreg_table.copy()
+        dispatch_table = snapshot.copy()
+        # Explicitly registered reducers take precedence
+        if out_of_band:
+            dispatch_table.update(cls._buffer_reducers)
+        dispatch_table.update(cls._extra_reducers)
+        _dispatch_tables[key] = (snapshot, dispatch_table)
+        return dispatch_table
 
     @classmethod
     def register(cls, type, reduce):
         '''Register a reduce function for a type.'''
         cls._extra_reducers[type] = reduce
+        _dispatch_tables.clear()
+
+    @classmethod
+    def _register_buffer_reducer(cls, type, reduce):
+        cls._buffer_reducers[type] = reduce
+        _dispatch_tables.clear()
 
     @classmethod
     def dumps(cls, obj, protocol=None):
-        buf = io.BytesIO()
-        cls(buf, protocol).dump(obj)
-        return buf.getbuffer()
+        return cls._dumps(obj, protocol)[0]
+
+    @classmethod
+    def dumps_buffers(cls, obj, min_size=0):
+        '''
+        Pickle `obj` with protocol 5, keeping contiguous buffers of at least
+        `min_size` bytes out-of-band.
+
+        Returns the pickle data and the list of out-of-band buffers, to be
+        passed as `buffers` to loads().
+        '''
+        return cls._dumps(obj, 5, min_size)
 
-    loads = pickle.loads
+    @classmethod
+    def _dumps(cls, obj, protocol, min_size=None):
+        if protocol is None:
+            protocol = pickle.HIGHEST_PROTOCOL
+        if not FORCE_DILL:
+            outer = getattr(_undo_state, 'log', None)
+            log = _undo_state.log = []
+            try:
+                return _dump_with(cls, obj, protocol, min_size)
+            except _DILL_FALLBACK_ERRORS:
+                for func in reversed(log):
+                    func()
+                log = []
+            finally:
+                _undo_state.log = outer
+                if outer is not None:
+                    outer.extend(log)
+        return _dump_with(_DillForkingPickler, obj, protocol, min_size)
+
+    loads = dill.loads
+
+class _DillForkingPickler(dill.Pickler):
+    '''dill based pickler used when ForkingPickler fails.'''
+
+    def __init__(self, *args, **kwds):
+        super().__init__(*args, **kwds)
+        self.dispatch_table = ForkingPickler._make_dispatch_table(
+            kwds.get('buffer_callback') is not None)
+
+def _dump_with(pickler, obj, protocol, min_size):
+    # BytesIO is kept rather than a (pooled) bytearray with write=extend:
+    # getbuffer() already exposes the data without copying, pickling into
+    # it is at least as fast, and a pooled buffer could be reused while a
+    # caller still holds a view of it.
+    buf = io.BytesIO()
+    buffers = []
+    if min_size is None:
+        # buffer_callback is not accepted before Python 3.8
+        pickler(buf, protocol).dump(obj)
+        return buf.getbuffer(), buffers
+    def callback(picklebuf):
+        m = picklebuf.raw()
+        if m.nbytes < min_size:
+            return True
+        buffers.append(m)
+        return False
+    pickler(buf, protocol, buffer_callback=callback).dump(obj)
+    return buf.getbuffer(), buffers
 
 register = ForkingPickler.register
 
 def dump(obj, file, protocol=None):
     '''Replacement for pickle.dump() using ForkingPickler.'''
-    ForkingPickler(file, protocol).dump(obj)
+    file.write(ForkingPickler.dumps(obj, protocol))
 
 #
 # Platform specific definitions
@@ -122,7 +248,10 @@ def DupFd(fd):
         return popen_obj.DupFd(popen_obj.duplicate_for_child(fd))
     elif HAVE_SEND_HANDLE:
         from . import resource_sharer
-        return resource_sharer.DupFd(fd)
+        df = resource_sharer.DupFd(fd)
+        _add_undo(functools.partial(resource_sharer._resource_sharer.unregister,
+                                    df._id))
+        return df
     else:
         raise ValueError('SCM_RIGHTS appears not to be available')
 
@@ -153,6 +282,37 @@ def _rebuild_partial(func, args, keywords):
     return functools.partial(func, *args, **keywords)
 register(functools.partial, _reduce_partial)
 
+#
+# Let the contents of arrays be sent out-of-band (by dumps_buffers() only)
+#
+
+# The machine format of the items of each typecode, as understood by
+# array._array_reconstructor(), tells the receiver how to convert them.
+# It is looked up on first use, as creating arrays of some typecodes
+# (such as the deprecated 'u') emits warnings.
+_array_mformats = {}
+
+def _array_mformat(typecode):
+    mformat = _array_mformats.get(typecode)
+    if mformat is None:
+        mformat = array.array(typecode).__reduce_ex__(3)[1][2]
+        _array_mformats[typecode] = mformat
+    return mformat
+
+def _reduce_array(a):
+    return _rebuild_array, (a.typecode, _array_mformat(a.typecode),
+                            pickle.PickleBuffer(a))
+def _rebuild_array(typecode, mformat, data):
+    if mformat != _array_mformat(typecode):
+        # Sent by a machine with a different byte order or item size
+        return array._array_reconstructor(array.array, typecode, mformat,
+                                          bytes(data))
+    a = array.array(typecode)
+    a.frombytes(data)
+    return a
+if HAVE_PICKLE_BUFFER:
+    ForkingPickler._register_buffer_reducer(array.array, _reduce_array)
+
 #
 # Make sockets picklable
 #
@@ -183,6 +343,8 @@ class AbstractReducer(metaclass=ABCMeta):
     _reduce_method = _reduce_method
     _reduce_method_descriptor = _reduce_method_descriptor
     _rebuild_partial = _rebuild_partial
+    _reduce_array = _reduce_array
+    _rebuild_array = _rebuild_array
     _reduce_socket = _reduce_socket
     _rebuild_socket = _rebuild_socket
 
@@ -192,3 +354,5 @@ class AbstractReducer(metaclass=ABCMeta):
         register(type(int.__add__), _reduce_method_descriptor)
         register(functools.partial, _reduce_partial)
         register(socket.socket, _reduce_socket)
+        if HAVE_PICKLE_BUFFER:
+            ForkingPickler._register_buffer_reducer(array.array, _reduce_array)
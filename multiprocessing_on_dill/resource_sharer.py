@@ -60,6 +60,15 @@ class _ResourceSharer(object):
             self._cache[self._key] = (send, close)
             return (self._address, self._key)
 
+    def unregister(self, ident):
+        '''Close a registered resource which will never be requested.'''
+        address, key = ident
+        with self._lock:
+            entry = self._cache.pop(key, None)
+        if entry is not None:
+            send, close = entry
+            close()
+
     @staticmethod
     def get_connection(ident):
         '''Return connection from which to receive identified resource.'''
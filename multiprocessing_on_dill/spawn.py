@@ -13,6 +13,8 @@ import sys
 import runpy
 import types
 
+import dill
+
 from . import get_start_method, set_start_method
 from . import process
 from .context import reduction
@@ -98,9 +100,9 @@ def _main(fd):
     with os.fdopen(fd, 'rb', closefd=True) as from_parent:
         process.current_process()._inheriting = True
         try:
-            preparation_data = reduction.pickle.load(from_parent)
+            preparation_data = dill.load(from_parent)
             prepare(preparation_data)
-            self = reduction.pickle.load(from_parent)
+            self = dill.load(from_parent)
         finally:
             del process.current_process()._inheriting
     return self._bootstrap()
@@ -410,14 +410,8 @@ def _flush_std_streams():
 #
 
 def spawnv_passfds(path, args, passfds):
-    import _posixsubprocess
-    passfds = tuple(sorted(map(int, passfds)))
-    errpipe_read, errpipe_write = os.pipe()
-    try:
-        return _posixsubprocess.fork_exec(
-            args, [os.fsencode(path)], True, passfds, None, None,
-            -1, -1, -1, -1, -1, -1, errpipe_read, errpipe_write,
-            False, False, None)
-    finally:
-        os.close(errpipe_read)
-        os.close(errpipe_write)
+    # The arguments of _posixsubprocess.fork_exec() change between Python
+    # versions, so use the standard library's copy of this function
+    import multiprocessing.util
+    return multiprocessing.util.spawnv_passfds(os.fsencode(path), args,
+                                               passfds)
@@ -0,0 +1,324 @@
+import array
+import hmac
+import io
+import os
+import pickle
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from multiprocessing_on_dill import AuthenticationError, BufferTooShort
+from multiprocessing_on_dill import connection
+from multiprocessing_on_dill.connection import Client, Listener, Pipe, wait
+
+
+class TestConnection(unittest.TestCase):
+
+    def setUp(self):
+        self.a, self.b = Pipe()
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+
+    def test_send_recv(self):
+        obj = {'x': [1, 2.5, 'three'], 'f': lambda x: x + 1}
+        self.a.send(obj)
+        result = self.b.recv()
+        self.assertEqual(result['x'], obj['x'])
+        self.assertEqual(result['f'](1), 2)
+
+    def test_send_recv_raw_bytes(self):
+        a, b = Pipe(extended_frames=True)
+        with a, b:
+            for obj in (b'', b'abc', bytearray(b'def'), [b'ghi']):
+                a.send(obj)
+                result = b.recv()
+                self.assertEqual(result, obj)
+                self.assertIs(type(result), type(obj))
+
+    def test_plain_frames_by_default(self):
+        # Without extended frames, send() stays readable by recv_bytes()
+        # and by older versions
+        data = bytearray(range(256)) * 1024
+        for obj in (b'x', bytearray(b'y'), [pickle.PickleBuffer(data)]):
+            t = threading.Thread(target=self.a.send, args=(obj,))
+            t.start()
+            msg = self.b.recv_bytes()
+            t.join()
+            self.assertEqual(pickle.loads(msg), obj)
+
+    def test_send_recv_bytes(self):
+        for msg in (b'', b'abc', b'x' * 1000):
+            self.a.send_bytes(msg)
+            self.assertEqual(self.b.recv_bytes(), msg)
+
+    def test_send_bytes_array(self):
+        arr = array.array('i', range(10))
+        self.a.send_bytes(arr, 8, 12)
+        self.assertEqual(self.b.recv_bytes(), arr[2:5].tobytes())
+        self.a.send_bytes(memoryview(arr)[::2])
+        self.assertEqual(self.b.recv_bytes(), arr[::2].tobytes())
+
+    def test_large_message(self):
+        msg = bytes(range(256)) * 4096
+        t = threading.Thread(target=self.a.send_bytes, args=(msg,))
+        t.start()
+        self.assertEqual(self.b.recv_bytes(), msg)
+        t.join()
+
+    def test_out_of_band_buffers(self):
+        data = bytearray(range(256)) * 1024
+        obj = [pickle.PickleBuffer(data), b'small', 42]
+        a, b = Pipe(extended_frames=True)
+        with a, b:
+            t = threading.Thread(target=a.send, args=(obj,))
+            t.start()
+            result = b.recv()
+            t.join()
+        self.assertEqual(bytes(result[0]), data)
+        self.assertEqual(result[1:], [b'small', 42])
+
+    def test_recv_bytes_into(self):
+        msg = b'spam and eggs'
+        buf = bytearray(32)
+        self.a.send_bytes(msg)
+        self.assertEqual(self.b.recv_bytes_into(buf, 4), len(msg))
+        self.assertEqual(buf[4:4 + len(msg)], msg)
+
+        arr = array.array('i', range(8))
+        self.a.send_bytes(array.array('i', [7, 8]))
+        self.assertEqual(self.b.recv_bytes_into(arr, 8), 8)
+        self.assertEqual(list(arr), [0, 1, 7, 8, 4, 5, 6, 7])
+
+        self.a.send_bytes(b'x' * 64)
+        with self.assertRaises(BufferTooShort) as cm:
+            self.b.recv_bytes_into(buf)
+        self.assertEqual(cm.exception.args[0], b'x' * 64)
+
+    def test_send_file(self):
+        data = bytes(range(256)) * 8
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.seek(100)
+            self.a.send_file(f, 1000)
+            self.assertEqual(f.tell(), 1100)
+            self.assertEqual(self.b.recv_bytes(), data[100:1100])
+            self.assertRaises(OSError, self.a.send_file, f, len(data))
+            self.a.send_bytes(b'next')
+            self.assertEqual(self.b.recv_bytes(), b'next')
+
+    def test_send_file_unsupported(self):
+        with tempfile.TemporaryFile() as f:
+            f.write(b'abcdef')
+            f.seek(1)
+            with mock.patch('os.sendfile', side_effect=OSError(22, 'EINVAL')):
+                self.a.send_file(f, 4)
+            self.assertEqual(f.tell(), 5)
+            self.assertEqual(self.b.recv_bytes(), b'bcde')
+
+    def test_send_file_without_fd(self):
+        f = io.BytesIO(b'abcdef')
+        f.seek(1)
+        self.a.send_file(f, 3)
+        self.assertEqual(f.tell(), 4)
+        self.assertEqual(self.b.recv_bytes(), b'bcd')
+
+    def test_send_file_pipe(self):
+        r, w = os.pipe()
+        with open(r, 'rb') as f:
+            os.write(w, b'abcdefgh')
+            self.assertEqual(f.read(2), b'ab')   # leaves data buffered
+            os.write(w, b'ijkl')
+            os.close(w)
+            self.a.send_file(f, 8)
+            self.assertEqual(self.b.recv_bytes(), b'cdefghij')
+            self.assertRaises(OSError, self.a.send_file, f, 8)
+            self.a.send_bytes(b'next')
+            self.assertEqual(self.b.recv_bytes(), b'next')
+
+    def test_batch(self):
+        with self.a.batch():
+            for i in range(10):
+                self.a.send(i)
+            self.a.send_bytes(b'raw')
+            self.assertFalse(self.b.poll())
+        self.assertEqual([self.b.recv() for i in range(10)], list(range(10)))
+        self.assertEqual(self.b.recv_bytes(), b'raw')
+
+    def test_batch_flushed_by_recv(self):
+        self.a.begin_batch()
+        self.a.send('ping')
+        self.b.send('pong')
+        self.assertEqual(self.a.recv(), 'pong')
+        self.assertEqual(self.b.recv(), 'ping')
+        self.a.send('bye')
+        self.a.close()
+        self.assertEqual(self.b.recv(), 'bye')
+
+    def test_batch_flushed_by_wait(self):
+        self.a.begin_batch()
+        self.a.send('ping')
+        self.assertEqual(wait([self.a], 0), [])
+        self.assertTrue(self.b.poll(1))
+        self.assertEqual(self.b.recv(), 'ping')
+        self.a.end_batch()
+
+    def test_poll(self):
+        self.assertFalse(self.b.poll())
+        self.a.send(1)
+        self.assertTrue(self.b.poll())
+        self.assertTrue(self.b.poll(0.5))
+        self.b.recv()
+        self.assertFalse(self.b.poll(0.01))
+        self.a.close()
+        self.assertTrue(self.b.poll())
+
+    def test_recv_batch(self):
+        for i in range(5):
+            self.a.send(i)
+        self.a.send(b'raw')
+        self.assertEqual(self.b.recv_batch(), list(range(5)) + [b'raw'])
+        for msg in (b'x', b'yy', b'z' * 100):
+            self.a.send_bytes(msg)
+        self.assertEqual(self.b.recv_bytes_batch(maxsize=11), [b'x', b'yy'])
+        self.assertEqual(self.b.recv_bytes_batch(maxsize=11), [b'z' * 100])
+        self.assertFalse(self.b.poll())
+
+    def test_eof(self):
+        self.a.close()
+        self.assertRaises(EOFError, self.b.recv_bytes)
+
+    def test_wait(self):
+        c, d = Pipe()
+        try:
+            self.assertEqual(wait([self.b, d], 0), [])
+            self.a.send(1)
+            self.assertEqual(wait([self.b, d], 1), [self.b])
+            self.assertEqual(wait([d, self.b], 1), [self.b])
+            self.b.recv()
+            c.send(2)
+            self.assertEqual(wait([d], 1), [d])
+            self.assertEqual(wait([self.b], 0), [])
+            d.recv()
+        finally:
+            c.close()
+            d.close()
+        # The fds of the closed pipe may be reused by new connections
+        e, f = Pipe()
+        try:
+            e.send(3)
+            self.assertEqual(wait([self.b, f], 1), [f])
+        finally:
+            e.close()
+            f.close()
+
+    def test_oneway_pipe(self):
+        r, w = Pipe(duplex=False)
+        try:
+            w.send(list(range(10)))
+            self.assertEqual(r.recv(), list(range(10)))
+            w.send_bytes(b'y' * 1000)
+            self.assertTrue(r.poll(1))
+            self.assertEqual(r.recv_bytes(), b'y' * 1000)
+            w.send(1)
+            w.send(2)
+            self.assertEqual(r.recv_batch(), [1])
+        finally:
+            r.close()
+            w.close()
+
+
+class TestListener(unittest.TestCase):
+
+    @unittest.skipUnless(hasattr(socket, 'SO_REUSEPORT'), 'needs SO_REUSEPORT')
+    def test_clones(self):
+        listener = Listener(('localhost', 0), reuseport=True)
+        clone, = listener.clones(1)
+        self.assertEqual(clone.address, listener.address)
+        listener.close()
+        with clone:
+            client = Client(clone.address)
+            server = clone.accept()
+            client.send('ping')
+            self.assertEqual(server.recv(), 'ping')
+            client.close()
+            server.close()
+
+    def test_inet_socket_options(self):
+        with Listener(('localhost', 0)) as listener:
+            client = Client(listener.address)
+            server = listener.accept()
+            for conn in (client, server):
+                with socket.socket(fileno=os.dup(conn.fileno())) as s:
+                    self.assertTrue(s.getsockopt(socket.IPPROTO_TCP,
+                                                 socket.TCP_NODELAY))
+            client.send('ping')
+            self.assertEqual(server.recv(), 'ping')
+            client.close()
+            server.close()
+
+    def test_clones_without_reuseport(self):
+        with Listener(('localhost', 0)) as listener:
+            self.assertRaises(ValueError, listener.clones, 1)
+
+
+class TestAuthentication(unittest.TestCase):
+
+    def _connect(self, server_key, client_key):
+        with Listener(authkey=server_key) as listener:
+            result = []
+            def accept():
+                try:
+                    result.append(listener.accept())
+                except AuthenticationError as e:
+                    result.append(e)
+            t = threading.Thread(target=accept)
+            t.start()
+            try:
+                client = Client(listener.address, authkey=client_key)
+            finally:
+                t.join()
+            return client, result[0]
+
+    def test_authkey(self):
+        for key in (b'secret', b'k' * 100):
+            client, server = self._connect(key, key)
+            client.send('ping')
+            self.assertEqual(server.recv(), 'ping')
+            client.close()
+            server.close()
+
+    def test_wrong_authkey(self):
+        with self.assertRaises(AuthenticationError):
+            self._connect(b'secret', b'wrong')
+
+    def _legacy_deliver(self, conn, authkey):
+        message = os.urandom(20)
+        conn.send_bytes(connection.CHALLENGE + message)
+        response = conn.recv_bytes(256)
+        ok = response == hmac.new(authkey, message, 'md5').digest()
+        conn.send_bytes(connection.WELCOME if ok else connection.FAILURE)
+
+    def _legacy_answer(self, conn, authkey):
+        message = conn.recv_bytes(256)[len(connection.CHALLENGE):]
+        conn.send_bytes(hmac.new(authkey, message, 'md5').digest())
+        self.assertEqual(conn.recv_bytes(256), connection.WELCOME)
+
+    def test_legacy_peer(self):
+        # Both sides of a Client/Listener pair deliver and answer challenges
+        a, b = Pipe()
+        with a, b:
+            for new, legacy in ((connection.deliver_challenge,
+                                 self._legacy_answer),
+                                (connection.answer_challenge,
+                                 self._legacy_deliver)):
+                t = threading.Thread(target=legacy, args=(b, b'secret'))
+                t.start()
+                new(a, b'secret')
+                t.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,13 @@
 import unittest
+from multiprocessing_on_dill import get_context
 from multiprocessing_on_dill.pool import Pool
 
 def square(x):
     return x*x
 
+def call_and_send(conn, func):
+    conn.send(func())
+
 class TestCallables(unittest.TestCase):
 
     def test_function(self):
@@ -15,6 +19,23 @@ class TestCallables(unittest.TestCase):
         p = Pool(12)
         result = p.map(lambda x: x*x, range(10000), chunksize=1)
         self.assertListEqual(result, [x*x for x in range(10000)])
+    def _check_process_with_connection(self, method):
+        # The Connection is reduced before the lambda makes the standard
+        # pickler give up, so its fd must not be passed to the child twice
+        ctx = get_context(method)
+        a, b = ctx.Pipe()
+        with a, b:
+            p = ctx.Process(target=call_and_send, args=(b, lambda: 'hi'))
+            p.start()
+            self.assertEqual(a.recv(), 'hi')
+            p.join()
+        self.assertEqual(p.exitcode, 0)
+
+    def test_spawn_process_with_connection(self):
+        self._check_process_with_connection('spawn')
+
+    def test_forkserver_process_with_connection(self):
+        self._check_process_with_connection('forkserver')
 
 if __name__ == '__main__':
     unittest.main()
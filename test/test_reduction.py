@@ -0,0 +1,127 @@
+import array
+import copyreg
+import os
+import subprocess
+import sys
+import unittest
+from multiprocessing_on_dill import reduction, resource_sharer
+from multiprocessing_on_dill.connection import Pipe
+from multiprocessing_on_dill.reduction import ForkingPickler
+
+
+class TestForkingPickler(unittest.TestCase):
+
+    def test_standard_objects(self):
+        obj = [1, 2.5, 'three', (b'four',), {'five': None}]
+        self.assertEqual(ForkingPickler.loads(ForkingPickler.dumps(obj)), obj)
+
+    def test_dill_fallback(self):
+        k = 3
+        obj = {'f': lambda x: x * k}
+        self.assertEqual(ForkingPickler.loads(ForkingPickler.dumps(obj))['f'](2), 6)
+
+    def test_dill_fallback_releases_resources(self):
+        # The fd registered while the standard pickler was still trying
+        # must be released once dill takes over
+        a, b = Pipe()
+        try:
+            cache = resource_sharer._resource_sharer._cache
+            before = len(cache)
+            ForkingPickler.dumps((a, lambda: 1))
+            self.assertEqual(len(cache), before + 1)
+        finally:
+            a.close()
+            b.close()
+            resource_sharer.stop()
+
+    def test_main_by_value(self):
+        # Objects of __main__ must not be pickled by reference, as the
+        # name may not exist in the process unpickling them
+        namespace = {'__name__': '__main__'}
+        exec('def cube(x):\n'
+             '    return x ** 3\n'
+             'class Point:\n'
+             '    def __init__(self, x):\n'
+             '        self.x = x\n', namespace)
+        cube, Point = namespace['cube'], namespace['Point']
+        main = sys.modules['__main__']
+        main.cube, main.Point = cube, Point
+        try:
+            data = ForkingPickler.dumps((cube, Point(2)))
+        finally:
+            del main.cube, main.Point
+        result = ForkingPickler.loads(data)
+        self.assertEqual(result[0](3), 27)
+        self.assertEqual(result[1].x, 2)
+
+    def test_array(self):
+        arr = array.array('d', [1.5, 2.5, 3.5] * 10000)
+        for protocol in (2, 4, 5, None):
+            data = ForkingPickler.dumps(arr, protocol)
+            # In-band, arrays keep the standard reduction
+            self.assertNotIn(b'_rebuild_array', data)
+            self.assertEqual(ForkingPickler.loads(data), arr)
+        data, buffers = ForkingPickler.dumps_buffers(arr, 1024)
+        self.assertEqual(len(buffers), 1)
+        self.assertEqual(ForkingPickler.loads(data, buffers=buffers), arr)
+        self.assertEqual(ForkingPickler.loads(data, buffers=buffers).typecode, 'd')
+
+    def test_array_byte_order(self):
+        swapped = array.array('i', [1, 2, 3])
+        swapped.byteswap()
+        mformat = reduction._array_mformat('i') ^ 1   # other endianness
+        result = reduction._rebuild_array('i', mformat, swapped.tobytes())
+        self.assertEqual(result, array.array('i', [1, 2, 3]))
+
+    def test_import_without_warnings(self):
+        code = 'import multiprocessing_on_dill.reduction'
+        subprocess.check_call([sys.executable, '-W', 'error', '-c', code],
+                              cwd=os.path.dirname(os.path.dirname(
+                                  os.path.abspath(__file__))))
+
+    def test_register_overrides_buffer_reducer(self):
+        reduction.register(array.array, lambda a: (list, (a.tolist(),)))
+        try:
+            data, buffers = ForkingPickler.dumps_buffers(array.array('i', [1, 2]))
+            self.assertEqual(buffers, [])
+            self.assertEqual(ForkingPickler.loads(data), [1, 2])
+        finally:
+            del ForkingPickler._extra_reducers[array.array]
+            reduction._dispatch_tables.clear()
+
+    def test_register(self):
+        class Point:
+            def __init__(self, x):
+                self.x = x
+        ForkingPickler.dumps([1])
+        reduction.register(Point, lambda p: (int, (p.x,)))
+        try:
+            self.assertEqual(ForkingPickler.loads(ForkingPickler.dumps(Point(3))), 3)
+        finally:
+            del ForkingPickler._extra_reducers[Point]
+            reduction._dispatch_tables.clear()
+
+    def test_copyreg_change(self):
+        class Point:
+            def __init__(self, x):
+                self.x = x
+        try:
+            copyreg.pickle(Point, lambda p: (int, (p.x,)))
+            self.assertEqual(ForkingPickler.loads(ForkingPickler.dumps(Point(3))), 3)
+            # Replacing an entry keeps the size of copyreg's table
+            copyreg.pickle(Point, lambda p: (str, (p.x,)))
+            self.assertEqual(ForkingPickler.loads(ForkingPickler.dumps(Point(3))), '3')
+        finally:
+            del copyreg.dispatch_table[Point]
+
+    def test_force_dill(self):
+        reduction.FORCE_DILL = True
+        try:
+            data = ForkingPickler.dumps([1, 2])
+        finally:
+            reduction.FORCE_DILL = False
+        self.assertEqual(ForkingPickler.loads(data), [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()